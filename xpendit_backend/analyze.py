@@ -11,6 +11,7 @@ Uso:
   python analyze.py
   python analyze.py --csv ../staticfiles/gastos_historicos.csv
   python analyze.py --analysis-md ../output/ANALISIS.md
+  python analyze.py --no-cache
 
 Requisitos:
   - Definir OPEN_EXCHANGE_APP_ID (o OXR_APP_ID / APP_ID) en el entorno (.env)
@@ -20,14 +21,20 @@ from __future__ import annotations
 
 import argparse
 import csv
+import gzip
+import hashlib
 import json
 import os
+import sqlite3
+import ssl
 import sys
 from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import date, datetime
 from decimal import Decimal, InvalidOperation
+from operator import itemgetter
 from pathlib import Path
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 
 try:
     # Opcional: si lo tienes, carga .env
@@ -35,6 +42,18 @@ try:
 except Exception:  # pragma: no cover
     load_dotenv = None
 
+try:
+    # Opcional: parser JSON en C (acepta bytes directo); si no, json de la stdlib (también acepta bytes)
+    from orjson import loads as _json_loads  # type: ignore
+except Exception:  # pragma: no cover
+    _json_loads = json.loads
+
+try:
+    # Opcional: pool de conexiones keep-alive para OXR (viene con requests)
+    import urllib3  # type: ignore
+except Exception:  # pragma: no cover
+    urllib3 = None
+
 
 # Robusto a ubicaciones típicas:
 # - ejecutar desde /backend (donde vive la app engine)
@@ -47,12 +66,20 @@ elif (HERE / "backend" / "engine").exists():
 
 # Nombres según la versión actual del repo (ESP)
 from engine.models import Empleado, Gasto
+from engine.policy import POLITICA
 from engine.validator import validar_gasto
 
 
 OXR_BASE_URL = "https://openexchangerates.org/api"
 DEFAULT_ANALYSIS_MD = "../output/ANALISIS.md"
 DEFAULT_CSV_NAME = "../staticfiles/gastos_historicos.csv"
+OXR_MAX_WORKERS = 16  # requests concurrentes a OXR (1 por fecha)
+OXR_REINTENTOS = 3  # reintentos por request ante 429/5xx o error de conexión
+OXR_MAX_RETRY_AFTER = 5  # tope (segundos) a la espera que pide OXR (Retry-After) antes de reintentar
+HTTP_HEADERS = {"User-Agent": "xpendit-challenge/1.0"}
+DEFAULT_RATES_CACHE = Path.home() / ".cache" / "xpendit" / "oxr_rates.sqlite"
+DEFAULT_RESULTS_CACHE = Path.home() / ".cache" / "xpendit" / "resultados.json.gz"
+RESULTS_CACHE_VERSION = 1  # subir si cambia la lógica de validación/conversión
 
 
 def _load_env() -> None:
@@ -80,9 +107,21 @@ def _get_oxr_app_id() -> Optional[str]:
 
 
 def _parse_date(s: str) -> Optional[date]:
+    """Parsea YYYY-MM-DD a mano: evita la maquinaria de strptime por fila.
+
+    Igual que strptime("%Y-%m-%d"), acepta mes y día de 1 o 2 dígitos (p. ej. 2026-1-5).
+    """
+    partes = s.strip().split("-")
+    if len(partes) != 3:
+        return None
+    y, m, d = partes
+    if len(y) != 4 or not 1 <= len(m) <= 2 or not 1 <= len(d) <= 2:
+        return None
+    if not (y.isdigit() and m.isdigit() and d.isdigit()):
+        return None
     try:
-        return datetime.strptime(s, "%Y-%m-%d").date()
-    except Exception:
+        return date(int(y), int(m), int(d))
+    except ValueError:
         return None
 
 
@@ -93,140 +132,325 @@ def _parse_decimal(s: str) -> Optional[Decimal]:
         return None
 
 
-def leer_gastos(csv_path: Path) -> List[Gasto]:
-    gastos: List[Gasto] = []
+CSV_COLUMNAS = (
+    "gasto_id",
+    "empleado_id",
+    "empleado_nombre",
+    "empleado_apellido",
+    "empleado_cost_center",
+    "categoria",
+    "moneda",
+    "fecha",
+    "monto",
+)
 
+
+def iter_gastos(csv_path: Path, avisar: bool = True) -> Iterator[Gasto]:
+    """Lee el CSV en streaming (fila a fila), sin materializar la lista completa.
+
+    Usa csv.reader + itemgetter (sin armar un dict por fila como DictReader).
+    Con `avisar=False` no se repiten los [WARN] de filas inválidas en una segunda pasada.
+    Los gastos de un mismo empleado comparten una sola instancia de Empleado (es inmutable).
+    """
     with csv_path.open(newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            gasto_id = (row.get("gasto_id") or "").strip()
-            empleado_id = (row.get("empleado_id") or "").strip()
-            nombre = (row.get("empleado_nombre") or "").strip()
-            apellido = (row.get("empleado_apellido") or "").strip()
-            cost_center = (row.get("empleado_cost_center") or "").strip()
-            categoria = (row.get("categoria") or "").strip()
-            moneda = (row.get("moneda") or "").strip()
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
 
-            fecha = _parse_date(row.get("fecha", ""))
-            monto = _parse_decimal(row.get("monto", ""))
+        # Columnas ausentes apuntan a una celda extra vacía (equivalente a row.get(...) -> "")
+        ancho = len(header) + 1
+        idx = {name.strip(): i for i, name in enumerate(header)}
+        campos = itemgetter(*(idx.get(c, ancho - 1) for c in CSV_COLUMNAS))
+        # Un solo Empleado (inmutable) por empleado, compartido por todos sus gastos
+        empleados: Dict[Tuple[str, str, str, str], Empleado] = {}
+
+        for row in reader:
+            if not row:
+                # Línea en blanco: DictReader las omitía en silencio, csv.reader entrega []
+                continue
+            if len(row) < ancho:
+                row += [""] * (ancho - len(row))
+            (
+                gasto_id,
+                empleado_id,
+                nombre,
+                apellido,
+                cost_center,
+                categoria,
+                moneda,
+                fecha_raw,
+                monto_raw,
+            ) = (v.strip() for v in campos(row))
+
+            fecha = _parse_date(fecha_raw)
+            monto = _parse_decimal(monto_raw)
 
             if not gasto_id or not empleado_id or fecha is None or monto is None:
-                print(
-                    f"[WARN] Saltando fila: gasto_id={gasto_id!r} "
-                    f"fecha={row.get('fecha')!r} monto={row.get('monto')!r}"
-                )
+                if avisar:
+                    print(
+                        f"[WARN] Saltando fila: gasto_id={gasto_id!r} "
+                        f"fecha={fecha_raw!r} monto={monto_raw!r}"
+                    )
                 continue
 
-            emp = Empleado(
-                id=empleado_id,
-                nombre=nombre,
-                apellido=apellido,
-                cost_center=cost_center,
-            )
+            clave_emp = (empleado_id, nombre, apellido, cost_center)
+            emp = empleados.get(clave_emp)
+            if emp is None:
+                emp = empleados[clave_emp] = Empleado(
+                    id=empleado_id,
+                    nombre=nombre,
+                    apellido=apellido,
+                    cost_center=sys.intern(cost_center),
+                )
+            # Monedas, categorías y cost centers (este último, arriba en el Empleado) son pocos valores
+            # repetidos: se internan para compartir un solo str por valor (comparaciones y hashes más baratos)
             gs = Gasto(
                 id=gasto_id,
                 monto=float(monto),
-                moneda=moneda,
+                moneda=sys.intern(moneda),
                 fecha=fecha,
-                categoria=categoria,
+                categoria=sys.intern(categoria),
                 empleado=emp,
             )
-            gastos.append(gs)
+            yield gs
 
-    return gastos
+
+def leer_gastos(csv_path: Path) -> List[Gasto]:
+    return list(iter_gastos(csv_path))
 
 
-def detectar_duplicados(gastos: List[Gasto]) -> Tuple[Set[str], Dict[Tuple[str, str, str], List[str]]]:
-    """Duplicados exactos: mismo monto, moneda y fecha."""
-    groups: Dict[Tuple[str, str, str], List[str]] = defaultdict(list)
-    for gs in gastos:
-        key = (f"{round(gs.monto, 2):.2f}", gs.moneda, gs.fecha.isoformat())
-        groups[key].append(gs.id)
+ClaveDuplicado = Tuple[int, str, int]  # (monto en centavos, moneda, fecha ordinal)
 
-    dup_ids: Set[str] = set()
-    dup_groups: Dict[Tuple[str, str, str], List[str]] = {}
-    for k, ids in groups.items():
-        if len(ids) > 1:
-            dup_ids.update(ids)
-            dup_groups[k] = ids
+
+def clave_duplicado(gs: Gasto) -> ClaveDuplicado:
+    """Clave de duplicado exacto con valores nativos (el formateo queda para el reporte).
+
+    El monto va en centavos enteros: comparar/hashear ints es exacto, a diferencia de floats redondeados.
+    """
+    return (round(gs.monto * 100), gs.moneda, gs.fecha.toordinal())
+
+
+def registrar_duplicado(
+    gs: Gasto,
+    vistos: Dict[ClaveDuplicado, str],
+    repetidos: Dict[ClaveDuplicado, List[str]],
+) -> None:
+    """Acumula un gasto para la detección de duplicados (en streaming).
+
+    La gran mayoría de las claves aparece una sola vez, así que solo se guarda
+    el primer id; la lista de ids se crea recién cuando la clave se repite.
+    """
+    key = clave_duplicado(gs)
+    if key in vistos:
+        repetidos.setdefault(key, [vistos[key]]).append(gs.id)
+    else:
+        vistos[key] = gs.id
+
+
+def detectar_duplicados(
+    vistos: Dict[ClaveDuplicado, str],
+    repetidos: Dict[ClaveDuplicado, List[str]],
+) -> Tuple[Set[str], Dict[ClaveDuplicado, List[str]]]:
+    """Duplicados exactos: mismo monto, moneda y fecha.
+
+    Recibe lo acumulado por `registrar_duplicado`; los grupos se devuelven en
+    orden de primera aparición.
+    """
+    dup_groups = {k: repetidos[k] for k in vistos if k in repetidos} if repetidos else {}
+    dup_ids = {gid for ids in dup_groups.values() for gid in ids}
 
     return dup_ids, dup_groups
 
 
-def detectar_negativos(gastos: List[Gasto]) -> Set[str]:
-    return {gs.id for gs in gastos if gs.monto < 0}
+def _ssl_context() -> ssl.SSLContext:
+    """Nota: en macOS a veces falla SSL si el Python no tiene CA bundle.
+    Si certifi está disponible, lo usamos para minimizar errores por certificados.
+    """
+    try:
+        import certifi  # type: ignore
+
+        return ssl.create_default_context(cafile=certifi.where())
+    except Exception:
+        return ssl.create_default_context()
+
+
+# Pool keep-alive compartido por los threads: 1 handshake TCP+TLS por conexión, no por request.
+# Reintenta con backoff exponencial (0.5s, 1s, 2s) ante 429/5xx y errores de conexión.
+if urllib3 is not None:
+
+    class _RetryAcotado(urllib3.Retry):
+        """Retry que respeta Retry-After, pero con tope: un 429 no debe frenar el batch por horas."""
+
+        def get_retry_after(self, response):
+            retry_after = super().get_retry_after(response)
+            if retry_after is None:
+                return None
+            return min(retry_after, OXR_MAX_RETRY_AFTER)
+
+    _POOL = urllib3.PoolManager(num_pools=1, maxsize=OXR_MAX_WORKERS, ssl_context=_ssl_context())
+    _RETRY = _RetryAcotado(
+        total=OXR_REINTENTOS,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        raise_on_status=False,
+    )
+else:  # pragma: no cover
+    _POOL = None
 
 
 def _http_get_json(url: str) -> dict:
     """HTTP GET sin requests.
 
-    Nota: en macOS a veces falla SSL si el Python no tiene CA bundle.
-    Si certifi está disponible, lo usamos para minimizar errores por certificados.
+    Usa el pool keep-alive de urllib3 si está instalado; si no, urllib (una conexión por request).
     """
-    import ssl
+    if _POOL is not None:
+        try:
+            resp = _POOL.request("GET", url, headers=HTTP_HEADERS, timeout=20, retries=_RETRY)
+        except urllib3.exceptions.MaxRetryError as e:
+            # El mensaje de MaxRetryError incluye la URL (con el app_id): se propaga solo la causa
+            raise (e.reason or RuntimeError("Max retries")) from None
+        if resp.status >= 400:
+            raise RuntimeError(f"HTTP {resp.status}")
+        return _json_loads(resp.data)
+
     import urllib.request
 
+    req = urllib.request.Request(url, headers=HTTP_HEADERS)
+    with urllib.request.urlopen(req, timeout=20, context=_ssl_context()) as resp:
+        raw = resp.read()
+    return _json_loads(raw)
+
+
+def abrir_cache_tasas(path: Path) -> Optional[sqlite3.Connection]:
+    """Abre (o crea) el cache en disco de tasas históricas de OXR.
+
+    Si no se puede abrir, se sigue sin cache (solo red).
+    """
     try:
-        import certifi  # type: ignore
+        path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(path))
+        conn.execute("CREATE TABLE IF NOT EXISTS rates (date TEXT PRIMARY KEY, rates_json TEXT)")
+        return conn
+    except (OSError, sqlite3.Error) as e:
+        print(f"[WARN] No se pudo abrir cache de tasas {path}: {e}")
+        return None
 
-        ctx = ssl.create_default_context(cafile=certifi.where())
-    except Exception:
-        ctx = ssl.create_default_context()
 
-    req = urllib.request.Request(url, headers={"User-Agent": "xpendit-challenge/1.0"})
-    with urllib.request.urlopen(req, timeout=20, context=ctx) as resp:
-        raw = resp.read().decode("utf-8")
-    return json.loads(raw)
+def _leer_cache_tasas(cache: sqlite3.Connection, fecha_iso: str) -> dict:
+    try:
+        row = cache.execute("SELECT rates_json FROM rates WHERE date=?", (fecha_iso,)).fetchone()
+        return json.loads(row[0]) if row else {}
+    except (sqlite3.Error, ValueError):
+        return {}
 
 
 def fetch_tipos_cambio_agrupados_fecha(
     app_id: str,
-    needed_by_date: Dict[date, Set[str]],
-) -> Tuple[Dict[date, Dict[str, Decimal]], int]:
+    needed_by_date: Dict[int, Set[str]],
+    cache: Optional[sqlite3.Connection] = None,
+) -> Tuple[Dict[int, Dict[str, float]], int]:
     """Bonus: 1 llamada por fecha única.
 
-    Retorna (tasas_por_fecha, numero_de_requests).
-    """
-    tasas_por_fecha: Dict[date, Dict[str, Decimal]] = {}
-    req_count = 0
+    Las llamadas son independientes entre sí (I/O puro), así que se lanzan en
+    paralelo con un pool de threads: el tiempo total pasa de D * RTT a ~RTT.
+
+    Para hoy (y fechas futuras) se consulta `/latest`, que es lo que un batch
+    diario típicamente necesita; el resto va a `/historical/{fecha}`.
 
-    for d in sorted(needed_by_date.keys()):
-        symbols = sorted(needed_by_date[d])
-        if not symbols:
-            continue
+    Si se entrega `cache`, las tasas históricas (fechas anteriores a hoy, que ya
+    no cambian) se leen/escriben ahí y solo se consulta la red por las faltantes.
 
-        symbols_q = ",".join(symbols)
-        url = f"{OXR_BASE_URL}/historical/{d.isoformat()}.json?app_id={app_id}&symbols={symbols_q}"
-        req_count += 1
+    Las fechas vienen como ordinales (`date.toordinal()`); solo se pasan a
+    ISO para armar la URL y la clave del cache.
+
+    Retorna (tasas_por_fecha, numero_de_requests), indexado por ordinal.
+    """
+    tasas_por_fecha: Dict[int, Dict[str, float]] = {}
+    req_count = 0
+    hoy = date.today().toordinal()
+    cacheadas: Dict[int, dict] = {}
+    por_guardar: List[Tuple[str, str]] = []
+
+    pendientes = {d: syms for d, syms in needed_by_date.items() if syms}
+    iso = {d: date.fromordinal(d).isoformat() for d in pendientes}
+
+    if cache is not None:
+        for d in [d for d in pendientes if d < hoy]:
+            cacheadas[d] = _leer_cache_tasas(cache, iso[d])
+            if all(sym in cacheadas[d] for sym in pendientes[d]):
+                tasas_por_fecha[d] = {sym: float(cacheadas[d][sym]) for sym in pendientes.pop(d)}
+
+    if not pendientes:
+        return tasas_por_fecha, req_count
+
+    # Las monedas casi no varían entre fechas: se pide la unión en todas, así el query
+    # string (sort + join) se arma una sola vez y no una vez por fecha.
+    symbols_q = ",".join(sorted(set().union(*pendientes.values())))
+    query = ".json?app_id=" + app_id + "&symbols=" + symbols_q
+
+    def url_for(d: int) -> str:
+        # Hoy (o fechas futuras) aún no tiene tasa histórica cerrada: se usa /latest
+        if d >= hoy:
+            return OXR_BASE_URL + "/latest" + query
+        return OXR_BASE_URL + "/historical/" + iso[d] + query
+
+    def desde_cache(d: int) -> Dict[str, float]:
+        # Cache parcial: las monedas ya guardadas para la fecha sirven aunque falle la consulta
+        guardadas = cacheadas.get(d, {})
+        return {sym: float(guardadas[sym]) for sym in pendientes[d] if sym in guardadas}
+
+    # Todas las fechas >= hoy comparten la misma URL (/latest): se consulta una sola vez
+    fechas_por_url: Dict[str, List[int]] = defaultdict(list)
+    for d in pendientes:
+        fechas_por_url[url_for(d)].append(d)
+
+    with ThreadPoolExecutor(max_workers=min(OXR_MAX_WORKERS, len(fechas_por_url))) as ex:
+        futs = {ex.submit(_http_get_json, url): fechas for url, fechas in fechas_por_url.items()}
+        for fut in as_completed(futs):
+            req_count += 1
+            try:
+                raw_rates = fut.result().get("rates", {})
+                if not isinstance(raw_rates, dict):
+                    raise ValueError("respuesta sin 'rates'")
+            except Exception as e:
+                for d in futs[fut]:
+                    print(f"[WARN] Failed to fetch rates for {iso[d]}: {e}")
+                    tasas_por_fecha[d] = desde_cache(d)
+                continue
 
+            for d in futs[fut]:
+                parsed = desde_cache(d)
+                for sym in pendientes[d]:
+                    val = raw_rates.get(sym)
+                    if val is None:
+                        continue
+                    try:
+                        parsed[sym] = float(val)
+                    except (TypeError, ValueError):
+                        continue
+
+                tasas_por_fecha[d] = parsed
+                if cache is not None and d < hoy:
+                    # Se guardan todas las tasas recibidas (no solo las pedidas) para reusarlas
+                    por_guardar.append((iso[d], json.dumps({**cacheadas.get(d, {}), **raw_rates})))
+
+    if cache is not None and por_guardar:
         try:
-            payload = _http_get_json(url)
-            raw_rates = payload.get("rates", {})
-
-            parsed: Dict[str, Decimal] = {}
-            for sym in symbols:
-                val = raw_rates.get(sym)
-                if val is None:
-                    continue
-                try:
-                    parsed[sym] = Decimal(str(val))
-                except (InvalidOperation, ValueError):
-                    continue
-
-            tasas_por_fecha[d] = parsed
-        except Exception as e:
-            print(f"[WARN] Failed to fetch rates for {d.isoformat()}: {e}")
-            tasas_por_fecha[d] = {}
+            cache.executemany("INSERT OR REPLACE INTO rates (date, rates_json) VALUES (?, ?)", por_guardar)
+            cache.commit()
+        except sqlite3.Error as e:
+            print(f"[WARN] No se pudo escribir cache de tasas: {e}")
 
     return tasas_por_fecha, req_count
 
 
 def convertir_usd(
-    monto: Decimal,
+    monto: float,
     moneda: str,
-    fecha: date,
-    tasas_por_fecha: Dict[date, Dict[str, Decimal]],
-) -> Optional[Decimal]:
+    fecha_ord: int,
+    tasas_por_fecha: Dict[int, Dict[str, float]],
+) -> Optional[float]:
     """OXR devuelve tasas vs USD (1 USD = tasa[moneda] unidades).
 
     Para convertir moneda -> USD: usd = monto / tasa[moneda]
@@ -234,7 +458,7 @@ def convertir_usd(
     if moneda == "USD":
         return monto
 
-    rates = tasas_por_fecha.get(fecha) or {}
+    rates = tasas_por_fecha.get(fecha_ord) or {}
     rate = rates.get(moneda)
     if rate is None or rate == 0:
         return None
@@ -252,10 +476,160 @@ def _estado_por_antiguedad(fecha_gasto: date, hoy: date) -> str:
     return "RECHAZADO"
 
 
+def evaluar_gasto(gs: Gasto, tasas_por_fecha: Dict[int, Dict[str, float]], hoy: date) -> Tuple[dict, bool]:
+    """Convierte a USD (si aplica) y valida con el motor de reglas.
+
+    Retorna (resultado, hubo_tasa); hubo_tasa es False cuando se usó el fallback sin tasa.
+    """
+    if gs.moneda == "USD":
+        # Ya está en USD (la mayoría de las filas): ni conversión ni un Gasto nuevo por fila
+        return validar_gasto(gs, today=hoy), True
+
+    # 1) convertir a USD
+    usd_amount = convertir_usd(gs.monto, gs.moneda, gs.fecha.toordinal(), tasas_por_fecha)
+
+    if usd_amount is None:
+        # Fallback: no hay tasa. No dejamos que esto oculte reglas determinísticas.
+        base_status = _estado_por_antiguedad(gs.fecha, hoy)
+        status = base_status if base_status != "APROBADO" else "PENDIENTE"
+        result = {
+            "gasto_id": gs.id,
+            "status": status,
+            "alertas": [
+                {
+                    "codigo": "TASA_CAMBIO_NO_DISPONIBLE",
+                    "mensaje": f"No se pudo obtener tasa para {gs.moneda} en {gs.fecha.isoformat()}.",
+                }
+            ],
+        }
+        return result, False
+
+    gs_usd = Gasto(
+        id=gs.id,
+        monto=usd_amount,
+        moneda="USD",
+        fecha=gs.fecha,
+        categoria=gs.categoria,
+        empleado=gs.empleado,
+    )
+    return validar_gasto(gs_usd, today=hoy), True
+
+
+def huella_gasto(gs: Gasto) -> str:
+    """Hash de los campos que determinan el resultado de validar un gasto."""
+    campos = (gs.id, repr(gs.monto), gs.moneda, gs.fecha.isoformat(), gs.categoria, gs.empleado.cost_center)
+    return hashlib.blake2b("|".join(campos).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _firma_cache_resultados(hoy: date) -> str:
+    """Los resultados dependen de hoy (antigüedad) y de la política: si cambian, el cache no sirve."""
+    politica = json.dumps(POLITICA, sort_keys=True)
+    return f"{RESULTS_CACHE_VERSION}|{hoy.isoformat()}|{politica}"
+
+
+def cargar_cache_resultados(path: Path, hoy: date) -> Dict[str, list]:
+    """Lee el cache de resultados de la corrida anterior: gasto_id -> [huella, resultado]."""
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"[WARN] Ignorando cache de resultados {path}: {e}")
+        return {}
+
+    if data.get("firma") != _firma_cache_resultados(hoy):
+        return {}
+    return data.get("filas", {})
+
+
+def guardar_cache_resultados(path: Path, hoy: date, filas: Dict[str, list]) -> None:
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            json.dump({"firma": _firma_cache_resultados(hoy), "filas": filas}, f)
+    except OSError as e:
+        print(f"[WARN] No se pudo escribir cache de resultados {path}: {e}")
+
+
+def validar_con_cache(
+    gs: Gasto,
+    previos: Dict[str, list],
+    nuevos: Dict[str, list],
+    tasas_por_fecha: Dict[int, Dict[str, float]],
+    hoy: date,
+) -> dict:
+    """Valida `gs`, reutilizando el resultado de la corrida anterior si la fila no cambió.
+
+    Deja en `nuevos` lo que la próxima corrida puede reutilizar. El resultado devuelto
+    tiene su propia lista de alertas: las anomalías que agrega `main` no tocan el cache.
+    """
+    huella = huella_gasto(gs)
+    previo = previos.get(gs.id)
+    if previo is not None and previo[0] == huella:
+        nuevos[gs.id] = previo
+        return {**previo[1], "alertas": list(previo[1]["alertas"])}
+
+    result, con_tasa = evaluar_gasto(gs, tasas_por_fecha, hoy)
+    # Sin tasa, o con la tasa (aún no definitiva) de hoy, se recalcula en la próxima corrida
+    if con_tasa and (gs.moneda == "USD" or gs.fecha < hoy):
+        nuevos[gs.id] = [huella, {**result, "alertas": list(result["alertas"])}]
+    return result
+
+
+ANALISIS_MD_TEMPLATE = """\
+# ANALISIS - Desafío Técnico Xpendit (Parte 3)
+
+## 1) Desglose de gastos por estado
+
+- APROBADOS: {aprobados}
+- PENDIENTES: {pendientes}
+- RECHAZADOS: {rechazados}
+
+## 2) Anomalías detectadas
+
+### 2.1 Duplicados exactos (monto, moneda, fecha idénticos)
+
+{duplicados}
+### 2.2 Montos negativos
+
+{negativos}
+## 3) (Bonus) Optimización para evitar N+1 requests (Open Exchange Rates)
+
+### Problema
+Una implementación ingenua consulta Open Exchange Rates **por cada gasto no-USD** del CSV. \
+Eso genera el anti-patrón **N+1**: si hay `N` filas no-USD, haces `N` llamadas de red, \
+repitiendo trabajo (muchos gastos comparten fecha) y aumentando latencia y puntos de falla.
+
+### Solución aplicada
+Se implementó **prefetch por fecha**:
+
+1) Se agrupan gastos no-USD por **fecha** y se reúnen las **monedas** necesarias por día: `needed_by_date[fecha] = {{monedas}}`.
+2) Se hace **1 request por fecha única** a OXR solicitando solo los `symbols` requeridos.
+3) Se cachean tasas en memoria (`tasas_por_fecha`) y cada conversión posterior es O(1) (lookup en diccionario).
+
+### Beneficios
+- Menos round trips: `N → D` llamadas (N=no-USD={n_no_usd}, D=fechas únicas no-USD={d_fechas_no_usd}).
+- Menos variabilidad: menos chances de fallar por red/TLS/quotas.
+- Mejor performance y resultados más consistentes.
+
+### Fallback
+Si falla la obtención de tasas para una fecha (sin tasa o error de red), se agrega alerta `TASA_CAMBIO_NO_DISPONIBLE`. \
+El gasto queda **PENDIENTE** solo si no existe una razón más severa \
+(por ejemplo, reglas determinísticas que lo lleven a **RECHAZADO**, como antigüedad).
+
+## 4) Datos del lote
+
+- Total gastos: {n_total}
+- Distribución monedas: {monedas_count}
+- Requests OXR ejecutadas (en esta corrida): {oxr_requests}
+"""
+
+
 def write_analysis_md(
     path: Path,
     status_counts: Dict[str, int],
-    dup_groups: Dict[Tuple[str, str, str], List[str]],
+    dup_groups: Dict[ClaveDuplicado, List[str]],
     negative_ids: List[str],
     monedas_count: Dict[str, int],
     n_total: int,
@@ -263,77 +637,40 @@ def write_analysis_md(
     d_fechas_no_usd: int,
     oxr_requests: int,
 ) -> None:
-    def fmt_counts() -> str:
-        return (
-            f"- APROBADOS: {status_counts.get('APROBADO', 0)}\n"
-            f"- PENDIENTES: {status_counts.get('PENDIENTE', 0)}\n"
-            f"- RECHAZADOS: {status_counts.get('RECHAZADO', 0)}\n"
-        )
-
+    """Arma el reporte completo con un solo format() sobre ANALISIS_MD_TEMPLATE."""
     dup_examples = list(dup_groups.items())[:5]
     neg_examples = negative_ids[:10]
 
-    path.parent.mkdir(parents=True, exist_ok=True)
-
-    lines: List[str] = []
-    lines.append("# ANALISIS - Desafío Técnico Xpendit (Parte 3)\n\n")
-
-    lines.append("## 1) Desglose de gastos por estado\n\n")
-    lines.append(fmt_counts() + "\n")
-
-    lines.append("## 2) Anomalías detectadas\n\n")
-
-    lines.append("### 2.1 Duplicados exactos (monto, moneda, fecha idénticos)\n\n")
     if not dup_examples:
-        lines.append("No se encontraron duplicados exactos.\n")
+        duplicados = "No se encontraron duplicados exactos.\n"
     else:
-        for (monto, moneda, fecha), ids in dup_examples:
-            lines.append(f"- {fecha} | {monto} {moneda} | ids: {', '.join(ids)}\n")
+        duplicados = "".join(
+            f"- {date.fromordinal(fecha).isoformat()} | {monto / 100:.2f} {moneda} | ids: {', '.join(ids)}\n"
+            for (monto, moneda, fecha), ids in dup_examples
+        )
 
-    lines.append("\n### 2.2 Montos negativos\n\n")
     if not neg_examples:
-        lines.append("No se encontraron montos negativos.\n")
+        negativos = "No se encontraron montos negativos.\n"
     else:
-        lines.append(f"Ejemplos (ids): {', '.join(neg_examples)}\n")
-
-    lines.append("\n## 3) (Bonus) Optimización para evitar N+1 requests (Open Exchange Rates)\n\n")
-
-    # Versión corta, pero defendible: Problema -> Solución aplicada -> Beneficios -> Fallback
-    lines.append("### Problema\n")
-    lines.append(
-        "Una implementación ingenua consulta Open Exchange Rates **por cada gasto no-USD** del CSV. "
-        "Eso genera el anti-patrón **N+1**: si hay `N` filas no-USD, haces `N` llamadas de red, "
-        "repitiendo trabajo (muchos gastos comparten fecha) y aumentando latencia y puntos de falla.\n\n"
-    )
-
-    lines.append("### Solución aplicada\n")
-    lines.append(
-        "Se implementó **prefetch por fecha**:\n\n"
-        "1) Se agrupan gastos no-USD por **fecha** y se reúnen las **monedas** necesarias por día: `needed_by_date[fecha] = {monedas}`.\n"
-        "2) Se hace **1 request por fecha única** a OXR solicitando solo los `symbols` requeridos.\n"
-        "3) Se cachean tasas en memoria (`tasas_por_fecha`) y cada conversión posterior es O(1) (lookup en diccionario).\n\n"
-    )
+        negativos = f"Ejemplos (ids): {', '.join(neg_examples)}\n"
 
-    lines.append("### Beneficios\n")
-    lines.append(
-        f"- Menos round trips: `N → D` llamadas (N=no-USD={n_no_usd}, D=fechas únicas no-USD={d_fechas_no_usd}).\n"
-        "- Menos variabilidad: menos chances de fallar por red/TLS/quotas.\n"
-        "- Mejor performance y resultados más consistentes.\n\n"
-    )
-
-    lines.append("### Fallback\n")
-    lines.append(
-        "Si falla la obtención de tasas para una fecha (sin tasa o error de red), se agrega alerta `TASA_CAMBIO_NO_DISPONIBLE`. "
-        "El gasto queda **PENDIENTE** solo si no existe una razón más severa (por ejemplo, reglas determinísticas que lo lleven a **RECHAZADO**, como antigüedad).\n\n"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(
+        ANALISIS_MD_TEMPLATE.format(
+            aprobados=status_counts.get("APROBADO", 0),
+            pendientes=status_counts.get("PENDIENTE", 0),
+            rechazados=status_counts.get("RECHAZADO", 0),
+            duplicados=duplicados,
+            negativos=negativos,
+            n_no_usd=n_no_usd,
+            d_fechas_no_usd=d_fechas_no_usd,
+            n_total=n_total,
+            monedas_count=dict(monedas_count),
+            oxr_requests=oxr_requests,
+        ),
+        encoding="utf-8",
     )
 
-    lines.append("## 4) Datos del lote\n\n")
-    lines.append(f"- Total gastos: {n_total}\n")
-    lines.append(f"- Distribución monedas: {dict(monedas_count)}\n")
-    lines.append(f"- Requests OXR ejecutadas (en esta corrida): {oxr_requests}\n")
-
-    path.write_text("".join(lines), encoding="utf-8")
-
 
 def _resolver_csv_path(arg_csv: Optional[str]) -> Path:
     if arg_csv:
@@ -370,6 +707,24 @@ def main() -> int:
         default=DEFAULT_ANALYSIS_MD,
         help="Ruta de salida ANALISIS.md",
     )
+    parser.add_argument(
+        "--rates-cache",
+        dest="rates_cache",
+        default=str(DEFAULT_RATES_CACHE),
+        help="Ruta del cache sqlite de tasas históricas OXR",
+    )
+    parser.add_argument(
+        "--no-cache",
+        dest="no_cache",
+        action="store_true",
+        help="No leer ni escribir caches en disco (tasas OXR y resultados)",
+    )
+    parser.add_argument(
+        "--results-cache",
+        dest="results_cache",
+        default=str(DEFAULT_RESULTS_CACHE),
+        help="Ruta del cache (gzip) de resultados de la corrida anterior",
+    )
     args = parser.parse_args()
 
     csv_path = _resolver_csv_path(args.csv_path)
@@ -377,92 +732,85 @@ def main() -> int:
         print(f"[ERROR] No se encontró CSV. Probé: {csv_path}")
         return 2
 
-    gastos = leer_gastos(csv_path)
     hoy = datetime.now().date()
 
-    dup_ids, dup_groups = detectar_duplicados(gastos)
-    neg_ids = detectar_negativos(gastos)
-
+    # Pasada 1 (streaming): todos los agregados en un único recorrido,
+    # la memoria no crece con objetos Gasto.
+    vistos: Dict[ClaveDuplicado, str] = {}
+    repetidos: Dict[ClaveDuplicado, List[str]] = {}
+    neg_ids: Set[str] = set()
     # Bonus: agrupar por fecha las monedas necesarias (no-USD)
-    needed_by_date: Dict[date, Set[str]] = defaultdict(set)
-    for gs in gastos:
-        if gs.moneda and gs.moneda != "USD":
-            needed_by_date[gs.fecha].add(gs.moneda)
+    needed_by_date: Dict[int, Set[str]] = defaultdict(set)
+    monedas_count: Counter = Counter()
+    n_total = 0
+    n_no_usd = 0
+    for gs in iter_gastos(csv_path):
+        n_total += 1
+        monedas_count[gs.moneda] += 1
+        registrar_duplicado(gs, vistos, repetidos)
+        if gs.monto < 0:
+            neg_ids.add(gs.id)
+        if gs.moneda != "USD":
+            n_no_usd += 1
+            if gs.moneda:
+                needed_by_date[gs.fecha.toordinal()].add(gs.moneda)
+
+    dup_ids, dup_groups = detectar_duplicados(vistos, repetidos)
 
     app_id = _get_oxr_app_id()
-    tasas_por_fecha: Dict[date, Dict[str, Decimal]] = {}
+    tasas_por_fecha: Dict[int, Dict[str, float]] = {}
     oxr_requests = 0
 
     if any(needed_by_date.values()) and app_id:
-        tasas_por_fecha, oxr_requests = fetch_tipos_cambio_agrupados_fecha(app_id, needed_by_date)
+        cache = None if args.no_cache else abrir_cache_tasas(Path(args.rates_cache))
+        try:
+            tasas_por_fecha, oxr_requests = fetch_tipos_cambio_agrupados_fecha(app_id, needed_by_date, cache)
+        finally:
+            if cache is not None:
+                cache.close()
     elif any(needed_by_date.values()) and not app_id:
         print("[WARN] Falta OPEN_EXCHANGE_APP_ID. Gastos no-USD pueden quedar sin conversión.")
 
-    resultados: List[dict] = []
+    # Resultados de la corrida anterior: filas sin cambios no se revalidan ni reconvierten.
+    previos = {} if args.no_cache else cargar_cache_resultados(Path(args.results_cache), hoy)
+    nuevos: Dict[str, list] = {}
+
     status_counts = {"APROBADO": 0, "PENDIENTE": 0, "RECHAZADO": 0}
 
-    for gs in gastos:
-        # 1) convertir a USD si aplica
-        monto_dec = Decimal(str(gs.monto))
-        usd_amount = convertir_usd(monto_dec, gs.moneda, gs.fecha, tasas_por_fecha)
-
-        if gs.moneda != "USD" and usd_amount is None:
-            # Fallback: no hay tasa. No dejamos que esto oculte reglas determinísticas.
-            base_status = _estado_por_antiguedad(gs.fecha, hoy)
-            status = base_status if base_status != "APROBADO" else "PENDIENTE"
-            result = {
-                "gasto_id": gs.id,
-                "status": status,
-                "alertas": [
-                    {
-                        "codigo": "TASA_CAMBIO_NO_DISPONIBLE",
-                        "mensaje": f"No se pudo obtener tasa para {gs.moneda} en {gs.fecha.isoformat()}.",
-                    }
-                ],
-            }
-        else:
-            gs_usd = Gasto(
-                id=gs.id,
-                monto=float(usd_amount) if usd_amount is not None else gs.monto,
-                moneda="USD",
-                fecha=gs.fecha,
-                categoria=gs.categoria,
-                empleado=gs.empleado,
-            )
-            result = validar_gasto(gs_usd)
+    # Pasada 2 (streaming): conversión + validación, ya con las tasas en memoria.
+    for gs in iter_gastos(csv_path, avisar=False):
+        result = validar_con_cache(gs, previos, nuevos, tasas_por_fecha, hoy)
 
-        # 2) anomalías
-        result.setdefault("alertas", [])
+        # 2) anomalías (validar_gasto y el fallback siempre devuelven "alertas" como lista)
+        alertas = result["alertas"]
 
         if gs.id in dup_ids:
-            result["alertas"].append(
+            alertas.append(
                 {
                     "codigo": "DUPLICADO_EXACTO",
                     "mensaje": "Posible gasto duplicado (monto, moneda y fecha coinciden con otro).",
                 }
             )
-            if result.get("status") == "APROBADO":
+            if result["status"] == "APROBADO":
                 result["status"] = "PENDIENTE"
 
         if gs.id in neg_ids:
-            result["alertas"].append(
+            alertas.append(
                 {
                     "codigo": "MONTO_NEGATIVO",
                     "mensaje": "El monto del gasto es negativo; dato sospechoso/erróneo.",
                 }
             )
-            if result.get("status") != "RECHAZADO":
-                result["status"] = "RECHAZADO"
+            result["status"] = "RECHAZADO"
 
         status_counts[result["status"]] += 1
-        resultados.append(result)
+
+    if not args.no_cache:
+        guardar_cache_resultados(Path(args.results_cache), hoy, nuevos)
 
     print(status_counts)
 
-    monedas_count = Counter(gs.moneda for gs in gastos)
-    n_total = len(gastos)
-    n_no_usd = sum(1 for gs in gastos if gs.moneda != "USD")
-    d_fechas_no_usd = len([d for d, s in needed_by_date.items() if s])
+    d_fechas_no_usd = len(needed_by_date)
 
     analysis_md_path = Path(args.analysis_md)
     write_analysis_md(
@@ -1,6 +1,21 @@
+import threading
+from datetime import date
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class EngineConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "engine"
+
+
+def precargar_tasas():
+    # Precarga opcional del cache de tasas (settings.OXR_MONEDAS_PRECARGA). Se llama desde wsgi.py / asgi.py,
+    # no desde ready(): así solo la hacen los procesos que atienden requests (no migrate, shell ni test).
+    # Los gastos que llegan al endpoint suelen ser del día, así que se precargan las tasas de hoy.
+    # Corre en un thread aparte para no bloquear el arranque si OXR está lento.
+    monedas = getattr(settings, "OXR_MONEDAS_PRECARGA", [])
+    if not monedas or not settings.OXR_APP_ID:
+        return
+    from engine.exchange import warmup_cache
+    threading.Thread(target=warmup_cache, args=(monedas, date.today()), daemon=True).start()
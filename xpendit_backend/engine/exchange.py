@@ -1,37 +1,239 @@
-import os, requests
+import os, requests, threading, time
+from collections import OrderedDict
 from datetime import date
+from typing import Iterable
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    from orjson import loads as _json_loads # Opcional: parser JSON en C, lee los bytes de la respuesta
+except ImportError:
+    from json import loads as _json_loads
+
+try:
+    import redis # Opcional: cache de tasas compartido entre workers (REDIS_URL)
+except ImportError:
+    redis = None
 
 OXR_APP_ID = os.getenv("OXR_APP_ID") # Acceso al App ID de OpenExchangeRates desde .env
 MONEDA_BASE = "USD" # La moneda base de la política con la que estamos trabajando
+OXR_BASE_URL = "https://openexchangerates.org/api"
+OXR_TIMEOUT = (3.05, 5) # (connect, read) en segundos
+OXR_MAX_RETRY_AFTER = 2 # tope (segundos) a la espera que pide OXR en un 429/503 antes de reintentar
+REDIS_URL = os.getenv("REDIS_URL") # Si no está definida, solo se usa el cache en memoria
 
-def get_tasa_cambio(moneda: str, fecha: date = None) -> float:
+class _RetryAcotado(Retry):
+    # Un Retry-After largo (p. ej. en un 429) dejaría el thread de Django dormido todo ese tiempo
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, OXR_MAX_RETRY_AFTER)
+
+# Sesión compartida a nivel de módulo: reutiliza las conexiones keep-alive (TCP + TLS)
+# entre llamadas a OXR en vez de abrir una conexión nueva por cada consulta
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=32,
+    # raise_on_status=False: agotados los reintentos se devuelve la última respuesta (su status se
+    # revisa abajo) en vez de un RetryError, cuyo mensaje incluye la URL con el app_id
+    max_retries=_RetryAcotado(
+        total=3,
+        backoff_factor=0.2,
+        status_forcelist=[429, 500, 502, 503, 504],
+        raise_on_status=False,
+    ),
+))
+
+# Cache en memoria de tasas (LRU + TTL): (MONEDA, fecha | None) -> (tasa, instante de inserción)
+# OXR actualiza las tasas "latest" cada hora; las históricas ya cerradas no cambian.
+# Un worker de Django vive mucho tiempo y cada (moneda, fecha) distinta es una entrada nueva:
+# se acota el tamaño descartando las menos usadas.
+_RATE_CACHE: OrderedDict[tuple[str, date | None], tuple[float, float]] = OrderedDict()
+_RATE_CACHE_LOCK = threading.Lock() # las vistas de Django corren en múltiples threads
+_RATE_CACHE_MAX = 4096 # entradas
+_RATE_TTL_LATEST = 300 # 5 min
+_RATE_TTL_HISTORICAL = 86400 * 30 # 30 días
+
+def _ttl_para(fecha: date | None) -> float:
+    # La tasa de hoy (o una fecha futura) todavía puede cambiar: se trata como "latest"
+    if fecha is None or fecha >= date.today():
+        return _RATE_TTL_LATEST
+    return _RATE_TTL_HISTORICAL
+
+def _cache_get(key: tuple[str, date | None]) -> float | None:
+    with _RATE_CACHE_LOCK:
+        entry = _RATE_CACHE.get(key)
+        if entry is None:
+            return None
+        tasa, ts = entry
+        if time.monotonic() - ts >= _ttl_para(key[1]):
+            # Expirada: se descarta para no acumular entradas que ya no sirven
+            del _RATE_CACHE[key]
+            return None
+        _RATE_CACHE.move_to_end(key)
+    return tasa
+
+def _cache_set_many(tasas: dict[str, float], fecha: date | None) -> None:
+    # Todas las tasas de una misma respuesta comparten el instante de inserción
+    ts = time.monotonic()
+    with _RATE_CACHE_LOCK:
+        for moneda, tasa in tasas.items():
+            _RATE_CACHE[(moneda, fecha)] = (tasa, ts)
+            _RATE_CACHE.move_to_end((moneda, fecha))
+        while len(_RATE_CACHE) > _RATE_CACHE_MAX:
+            _RATE_CACHE.popitem(last=False)
+
+# Circuit breaker: tras varias fallas seguidas de OXR se deja de consultar por un rato, así un OXR
+# caído o lento no acumula requests de Django esperando el timeout (la validación queda PENDIENTE).
+_BREAKER_MAX_FALLAS = 5
+_BREAKER_ESPERA = 30 # segundos con el circuito abierto
+_breaker = {"fallas": 0, "abierto_hasta": 0.0}
+_BREAKER_LOCK = threading.Lock()
+
+def _breaker_abierto() -> bool:
+    with _BREAKER_LOCK:
+        return time.monotonic() < _breaker["abierto_hasta"]
+
+def _breaker_registrar(ok: bool) -> None:
+    with _BREAKER_LOCK:
+        if ok:
+            _breaker["fallas"] = 0
+            return
+        _breaker["fallas"] += 1
+        if _breaker["fallas"] >= _BREAKER_MAX_FALLAS:
+            _breaker["abierto_hasta"] = time.monotonic() + _BREAKER_ESPERA
+
+# Segundo nivel de cache (Redis), compartido por todos los workers de Django/gunicorn:
+# el primer worker que consulta una tasa la deja disponible para el resto.
+_redis = None
+_redis_iniciado = False
+
+def _get_redis():
+    global _redis, _redis_iniciado
+    if not _redis_iniciado:
+        _redis_iniciado = True
+        if redis is not None and REDIS_URL:
+            try:
+                _redis = redis.Redis.from_url(REDIS_URL, socket_timeout=0.5, socket_connect_timeout=0.5)
+            except Exception as e:
+                print(f"No se pudo configurar Redis ({e}); se usará solo el cache en memoria")
+    return _redis
+
+def _redis_key(moneda: str, fecha: date | None) -> str:
+    return f"oxr:{moneda}:{fecha.isoformat() if fecha else 'latest'}"
+
+def _redis_get_many(monedas: list[str], fecha: date | None) -> dict[str, float]:
+    cliente = _get_redis()
+    if cliente is None or not monedas:
+        return {}
+    try:
+        valores = cliente.mget([_redis_key(m, fecha) for m in monedas])
+        return {m: float(v) for m, v in zip(monedas, valores) if v is not None}
+    except Exception as e:
+        # Una caída de Redis no debe romper la validación: se sigue hacia OXR
+        print(f"Error al leer tasas desde Redis: {e}")
+        return {}
+
+def _redis_set_many(tasas: dict[str, float], fecha: date | None) -> None:
+    cliente = _get_redis()
+    if cliente is None or not tasas:
+        return
+    try:
+        ttl = int(_ttl_para(fecha))
+        pipe = cliente.pipeline()
+        for moneda, tasa in tasas.items():
+            pipe.setex(_redis_key(moneda, fecha), ttl, str(tasa))
+        pipe.execute()
+    except Exception as e:
+        print(f"Error al guardar tasas en Redis: {e}")
+
+def get_tasas_cambio(monedas: Iterable[str], fecha: date = None) -> dict[str, float]:
     """
-    Obtener el tipo de cambio de 1 unidad de 'moneda' a 'USD'.
-    Si se especifica 'fecha', obtener el tipo de cambio histórico para esa fecha, de lo contrario, el más reciente.
-    Retorna el valor del tipo de cambio (1 USD por 1 unidad de 'moneda').
+    Obtener en una sola llamada a OXR (parámetro 'symbols' con varias monedas) el tipo de cambio
+    de varias monedas a 'USD'. Las que ya están en cache no se vuelven a pedir:
+    cache en memoria -> Redis (si REDIS_URL) -> OXR.
+    Retorna un dict {MONEDA: tasa} solo con las monedas para las que se obtuvo tasa.
     """
-    if moneda.upper() == MONEDA_BASE:
-        return 1.0
+    tasas = {}
+    faltantes = []
+    for moneda in sorted({m.upper() for m in monedas}):
+        if moneda == MONEDA_BASE:
+            tasas[moneda] = 1.0
+            continue
+        tasa = _cache_get((moneda, fecha))
+        if tasa is None:
+            faltantes.append(moneda)
+        else:
+            tasas[moneda] = tasa
+    if faltantes:
+        desde_redis = _redis_get_many(faltantes, fecha)
+        if desde_redis:
+            _cache_set_many(desde_redis, fecha)
+            tasas.update(desde_redis)
+            faltantes = [m for m in faltantes if m not in desde_redis]
+    if not faltantes:
+        return tasas
     if OXR_APP_ID is None:
         raise RuntimeError("La API Key de Open Exchange Rates no ha sido configurada.")
+    if _breaker_abierto():
+        # OXR falló varias veces seguidas: no se consulta hasta que pase la espera
+        print(f"OXR no disponible (circuito abierto); sin tasa de cambio para {','.join(faltantes)}")
+        return tasas
+    # Solo cuentan para el circuit breaker las fallas de OXR (red, timeout, 429, 5xx, app_id rechazado),
+    # no un 4xx provocado por el propio request (p. ej. una fecha anterior a 1999): si no, cualquier
+    # cliente podría abrir el circuito para todos con unos pocos requests inválidos.
+    falla_de_oxr = True
     try:
-        if fecha:
+        if fecha and fecha < date.today():
             # Endpoint de tipos de cambio históricos
             datestr = fecha.strftime("%Y-%m-%d")
-            url = f"https://openexchangerates.org/api/historical/{datestr}.json?app_id={OXR_APP_ID}&base={MONEDA_BASE}&symbols={moneda}"
+            url = f"{OXR_BASE_URL}/historical/{datestr}.json"
         else:
-            # Endpoint de tasas más recientes
-            url = f"https://openexchangerates.org/api/latest.json?app_id={OXR_APP_ID}&base={MONEDA_BASE}&symbols={moneda}"
-        response = requests.get(url)
-        data = response.json()
+            # Endpoint de tasas más recientes (hoy o una fecha futura aún no tienen tasa histórica)
+            url = f"{OXR_BASE_URL}/latest.json"
+        # Parámetros por separado (no en la URL) para que el pool reutilice la conexión al host
+        params = {"app_id": OXR_APP_ID, "base": MONEDA_BASE, "symbols": ",".join(faltantes)}
+        response = _session.get(url, params=params, timeout=OXR_TIMEOUT)
+        # Un 4xx/5xx (p. ej. app_id inválido) se reporta como error y no se intenta leer 'rates'.
+        # No se usa raise_for_status(): su mensaje incluye la URL, con el app_id.
+        if not response.ok:
+            falla_de_oxr = response.status_code in (401, 403, 429) or response.status_code >= 500
+            raise RuntimeError(f"HTTP {response.status_code}")
+        # Se parsean los bytes directamente (sin la detección de encoding de response.json())
+        data = _json_loads(response.content)
         # La API retornará el valor de las tasas como un diccionario dentro de 'rates'
-        tasa = data["rates"].get(moneda.upper())
-        if tasa is None:
-            raise ValueError(f"No existe la tasa de cambio para la moneda {moneda}")
-        return tasa
+        obtenidas = {m: data["rates"][m] for m in faltantes if data["rates"].get(m) is not None}
+        for moneda in faltantes:
+            if moneda not in obtenidas:
+                print(f"No existe la tasa de cambio para la moneda {moneda}")
+        # Solo se cachean respuestas válidas: un error se vuelve a intentar en la próxima llamada
+        _cache_set_many(obtenidas, fecha)
+        _redis_set_many(obtenidas, fecha)
+        tasas.update(obtenidas)
+        _breaker_registrar(ok=True)
     except Exception as e:
-        # Handling de errores de red o errores en JSON
-        print(f"Se produjo un error al consultar la tasa de cambio para {moneda}: {e}")
-        return None
+        # Handling de errores de red o errores en JSON. Los errores de requests incluyen la URL
+        # (con el app_id) en su mensaje: de esos solo se registra el tipo.
+        detalle = type(e).__name__ if isinstance(e, requests.RequestException) else e
+        print(f"Se produjo un error al consultar la tasa de cambio para {','.join(faltantes)}: {detalle}")
+        if falla_de_oxr:
+            _breaker_registrar(ok=False)
+    return tasas
+
+def get_tasa_cambio(moneda: str, fecha: date = None) -> float:
+    """
+    Obtener el tipo de cambio de 1 unidad de 'moneda' a 'USD'.
+    Si se especifica 'fecha', obtener el tipo de cambio histórico para esa fecha, de lo contrario, el más reciente.
+    Retorna el valor del tipo de cambio (1 USD por 1 unidad de 'moneda'), o None si no se pudo obtener.
+    """
+    return get_tasas_cambio([moneda], fecha).get(moneda.upper())
+
+def warmup_cache(monedas: Iterable[str], fecha: date = None) -> None:
+    """
+    Precarga el cache con las tasas de 'monedas' (una sola llamada a OXR), p. ej. al iniciar el proceso.
+    """
+    get_tasas_cambio(monedas, fecha)
 
 
@@ -3,7 +3,7 @@ from dataclasses import dataclass
 from datetime import date
 
 # Create your models here.
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Empleado:
     id: str
     nombre: str
@@ -11,7 +11,7 @@ class Empleado:
     cost_center: str
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Gasto:
     id: str
     monto: float        # valor del gasto
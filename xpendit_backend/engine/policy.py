@@ -14,3 +14,48 @@ POLITICA = {
         # reglas adicionales del centro de costo pueden ser agregadas acá
     ]
 }
+
+# Tablas precalculadas a partir de POLITICA al importar el módulo, para que el validador
+# no recorra los dicts anidados (ni la lista de reglas) en cada gasto.
+MAX_PENDIENTE = POLITICA["limite_antiguedad"]["pendiente_dias"]
+MAX_RECHAZADO = POLITICA["limite_antiguedad"]["rechazado_dias"]
+# categoría -> (aprobado_hasta, pendiente_hasta)
+CAT_LIMITS = {
+    categoria: (limites["aprobado_hasta"], limites["pendiente_hasta"])
+    for categoria, limites in POLITICA["limites_por_categoria"].items()
+}
+# Alertas fijas (solo dependen de la política): se arman una vez y el validador agrega la misma
+# instancia a cada resultado. Son compartidas, así que no deben modificarse.
+ALERTA_ANTIGUEDAD_RECHAZO = {
+    "codigo": "LIMITE_ANTIGUEDAD",
+    "mensaje": f"Gasto excede los {MAX_RECHAZADO} días. No es reembolsable."
+}
+ALERTA_ANTIGUEDAD_PENDIENTE = {
+    "codigo": "LIMITE_ANTIGUEDAD",
+    "mensaje": f"Gasto excede los {MAX_PENDIENTE} días. Requiere revisión."
+}
+# categoría -> alerta
+ALERTAS_CATEGORIA_RECHAZO = {
+    categoria: {
+        "codigo": "LIMITE_CATEGORIA",
+        "mensaje": f"El gasto de '{categoria}' excede el límite permitido."
+    }
+    for categoria in CAT_LIMITS
+}
+ALERTAS_CATEGORIA_PENDIENTE = {
+    categoria: {
+        "codigo": "LIMITE_CATEGORIA",
+        "mensaje": f"El gasto de '{categoria}' excede el límite aprobado; requiere revisión."
+    }
+    for categoria in CAT_LIMITS
+}
+# (cost_center, categoría) prohibido -> alerta
+ALERTAS_CENTRO_COSTO = {
+    (regla["cost_center"], regla["categoria_prohibida"]): {
+        "codigo": "POLITICA_CENTRO_COSTO",
+        "mensaje": f"El C.C. '{regla['cost_center']}' no puede reportar a '{regla['categoria_prohibida']}'."
+    }
+    for regla in POLITICA.get("reglas_centro_costo", [])
+}
+# pares (cost_center, categoría) prohibidos
+PROHIBIDOS = frozenset(ALERTAS_CENTRO_COSTO)
@@ -1,7 +1,14 @@
+import io
+import json
+import requests
+import tempfile
+from pathlib import Path
 from django.test import TestCase
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from unittest import mock
 from engine.models import Empleado, Gasto
-from engine import validator
+from engine import exchange, validator, views
+import analyze
 
 
 class TestValidacionGastos(TestCase):
@@ -76,6 +83,27 @@ class TestValidacionGastos(TestCase):
         self.assertTrue(any(alerta["codigo"] == "LIMITE_CATEGORIA" for alerta in res3["alertas"]))
 
 
+    def test_sin_tasa_no_aplica_limite_categoria(self):
+        """
+        Si no hay tasa, el monto en moneda extranjera no se compara contra el límite en USD:
+        90.000 CLP en food queda PENDIENTE solo por ERROR_TASA_CAMBIO (no RECHAZADO por 90.000 > 150).
+        """
+        gasto = Gasto(id="g_sin_tasa", monto=90000, moneda="CLP", fecha=self.today, categoria="food", empleado=self.empleado_ventas)
+        with mock.patch.object(validator, "get_tasa_cambio", return_value=None):
+            resultado = validator.validar_gasto(gasto)
+        self.assertEqual(resultado["status"], "PENDIENTE")
+        self.assertEqual([alerta["codigo"] for alerta in resultado["alertas"]], ["ERROR_TASA_CAMBIO"])
+
+    def test_fecha_referencia_inyectada(self):
+        """
+        Con 'today' explícito, la antigüedad se mide contra esa fecha (no contra la fecha actual).
+        """
+        fecha_gasto = self.today - timedelta(days=90)
+        gasto = Gasto(id="g_ref", monto=20, moneda="USD", fecha=fecha_gasto, categoria="food", empleado=self.empleado_ventas)
+        resultado = validator.validar_gasto(gasto, today=fecha_gasto + timedelta(days=10))
+        self.assertEqual(resultado["status"], "APROBADO")
+        self.assertEqual(resultado["alertas"], [])
+
     def test_centro_costos_prohibiciones(self):
         """
         Cost center 'core_engineering' reportando 'food' -> siempre RECHAZADO.
@@ -100,5 +128,452 @@ class TestValidacionGastos(TestCase):
         codigos = {alerta["codigo"] for alerta in resultado["alertas"]}
         # Debe contener todas las alertas relevantes
         self.assertTrue({"LIMITE_ANTIGUEDAD", "LIMITE_CATEGORIA", "POLITICA_CENTRO_COSTO"}.issubset(codigos))
+        # Orden estable de las alertas en la respuesta: antigüedad, categoría, centro de costo
+        self.assertEqual(
+            [alerta["codigo"] for alerta in resultado["alertas"]],
+            ["LIMITE_ANTIGUEDAD", "LIMITE_CATEGORIA", "POLITICA_CENTRO_COSTO"],
+        )
+
+
+class _OxrMockMixin:
+    """
+    Nunca salir a la red en tests: se simula la respuesta de OXR (self.mock_get) y se deja
+    el estado global de engine.exchange (cache de tasas y circuit breaker) limpio antes y después.
+    """
+    def setUp(self):
+        super().setUp()
+        exchange._RATE_CACHE.clear()
+        self.today = datetime.now().date()
+        patcher_app_id = mock.patch.object(exchange, "OXR_APP_ID", "test_app_id")
+        patcher_get = mock.patch.object(exchange._session, "get")
+        patcher_app_id.start()
+        self.mock_get = patcher_get.start()
+        self.addCleanup(patcher_app_id.stop)
+        self.addCleanup(patcher_get.stop)
+        self.addCleanup(exchange._RATE_CACHE.clear)
+        self.addCleanup(exchange._breaker.update, fallas=0, abierto_hasta=0.0)
+
+
+class TestCacheTasasCambio(_OxrMockMixin, TestCase):
 
+    def test_tasa_repetida_usa_cache(self):
+        """
+        Misma moneda y fecha consultadas dos veces -> una sola llamada HTTP a OXR.
+        """
+        self.mock_get.return_value.content = json.dumps({"rates": {"CLP": 900.0}}).encode()
+        fecha = self.today - timedelta(days=5)
+        self.assertEqual(exchange.get_tasa_cambio("CLP", fecha=fecha), 900.0)
+        self.assertEqual(exchange.get_tasa_cambio("clp", fecha=fecha), 900.0)
+        self.assertEqual(self.mock_get.call_count, 1)
+
+    def test_cache_acotado_y_sin_expiradas(self):
+        """
+        El cache descarta la entrada menos usada al superar el máximo, y las expiradas al leerlas.
+        """
+        fecha = self.today - timedelta(days=5)
+        with mock.patch.object(exchange, "_RATE_CACHE_MAX", 2):
+            exchange._cache_set_many({"CLP": 900.0, "MXN": 18.0}, fecha)
+            self.assertEqual(exchange._cache_get(("CLP", fecha)), 900.0) # CLP pasa a ser la más reciente
+            exchange._cache_set_many({"EUR": 0.9}, fecha)
+        self.assertEqual(list(exchange._RATE_CACHE), [("CLP", fecha), ("EUR", fecha)])
+        with mock.patch.object(exchange, "_RATE_TTL_HISTORICAL", 0):
+            self.assertIsNone(exchange._cache_get(("EUR", fecha)))
+        self.assertNotIn(("EUR", fecha), exchange._RATE_CACHE)
+
+    def test_error_no_se_cachea(self):
+        """
+        Si OXR falla, no se guarda nada: la siguiente consulta vuelve a la red.
+        """
+        self.mock_get.side_effect = [ValueError("JSON inválido"), mock.DEFAULT]
+        self.mock_get.return_value.content = json.dumps({"rates": {"MXN": 18.0}}).encode()
+        self.assertIsNone(exchange.get_tasa_cambio("MXN"))
+        self.assertEqual(exchange.get_tasa_cambio("MXN"), 18.0)
+        self.assertEqual(self.mock_get.call_count, 2)
+
+    def test_error_http_no_se_cachea(self):
+        """
+        Una respuesta 4xx/5xx de OXR se trata como error aunque traiga un JSON en el cuerpo,
+        y el app_id (parte de la URL) no aparece en lo que se registra.
+        """
+        self.mock_get.return_value.ok = False
+        self.mock_get.return_value.status_code = 401
+        self.mock_get.return_value.content = b'{"error": true, "status": 401}'
+        with mock.patch("sys.stdout", new_callable=io.StringIO) as salida:
+            self.assertIsNone(exchange.get_tasa_cambio("CLP"))
+            # Error de red cuyo mensaje trae la URL completa
+            self.mock_get.side_effect = requests.ConnectionError(
+                "Max retries exceeded with url: /api/latest.json?app_id=test_app_id&base=USD"
+            )
+            self.assertIsNone(exchange.get_tasa_cambio("CLP"))
+        self.assertNotIn(("CLP", None), exchange._RATE_CACHE)
+        self.assertIn("HTTP 401", salida.getvalue())
+        self.assertNotIn("test_app_id", salida.getvalue())
+
+    def test_reintentos_no_esperan_de_mas(self):
+        """
+        Un Retry-After largo de OXR se acota, y agotar reintentos no levanta RetryError (URL con app_id).
+        """
+        retry = exchange._session.get_adapter(exchange.OXR_BASE_URL).max_retries
+        self.assertFalse(retry.raise_on_status)
+        respuesta = mock.Mock(headers={"Retry-After": "3600"})
+        self.assertEqual(retry.get_retry_after(respuesta), exchange.OXR_MAX_RETRY_AFTER)
+
+    def test_varias_monedas_una_sola_llamada(self):
+        """
+        get_tasas_cambio pide todas las monedas en un solo request (symbols=CLP,MXN) y las deja en cache.
+        """
+        self.mock_get.return_value.content = json.dumps({"rates": {"CLP": 900.0, "MXN": 18.0}}).encode()
+        tasas = exchange.get_tasas_cambio(["clp", "MXN", "USD"])
+        self.assertEqual(tasas, {"CLP": 900.0, "MXN": 18.0, "USD": 1.0})
+        self.assertEqual(self.mock_get.call_args.kwargs["params"]["symbols"], "CLP,MXN")
+        self.assertEqual(exchange.get_tasa_cambio("MXN"), 18.0)
+        self.assertEqual(self.mock_get.call_count, 1)
+
+    def test_tasa_desde_redis_evita_llamada(self):
+        """
+        Si otro worker ya dejó la tasa en Redis, no se consulta OXR y queda en el cache en memoria.
+        """
+        cliente = mock.Mock()
+        cliente.mget.return_value = [b"950.5"]
+        with mock.patch.object(exchange, "_get_redis", return_value=cliente):
+            self.assertEqual(exchange.get_tasa_cambio("CLP"), 950.5)
+        self.assertEqual(exchange.get_tasa_cambio("CLP"), 950.5)
+        self.mock_get.assert_not_called()
+
+    def test_circuito_abierto_tras_fallas(self):
+        """
+        Tras 5 fallas seguidas de OXR no se vuelve a consultar durante la espera; luego se reintenta.
+        """
+        self.mock_get.side_effect = ConnectionError("OXR caído")
+        for _ in range(exchange._BREAKER_MAX_FALLAS):
+            self.assertIsNone(exchange.get_tasa_cambio("CLP"))
+        self.assertIsNone(exchange.get_tasa_cambio("CLP"))
+        self.assertEqual(self.mock_get.call_count, exchange._BREAKER_MAX_FALLAS)
+        # Pasada la espera, una consulta exitosa cierra el circuito
+        exchange._breaker["abierto_hasta"] = 0.0
+        self.mock_get.side_effect = None
+        self.mock_get.return_value.content = json.dumps({"rates": {"CLP": 900.0}}).encode()
+        self.assertEqual(exchange.get_tasa_cambio("CLP"), 900.0)
+        self.assertEqual(exchange._breaker["fallas"], 0)
+
+
+    def test_error_del_cliente_no_abre_circuito(self):
+        """
+        Un 400 de OXR (fecha inválida en el request) no cuenta como falla del servicio.
+        """
+        self.mock_get.return_value.ok = False
+        self.mock_get.return_value.status_code = 400
+        fecha_invalida = datetime(1990, 1, 1).date()
+        with mock.patch("sys.stdout", new_callable=io.StringIO):
+            for _ in range(exchange._BREAKER_MAX_FALLAS + 1):
+                self.assertIsNone(exchange.get_tasa_cambio("CLP", fecha=fecha_invalida))
+        self.assertFalse(exchange._breaker_abierto())
+        self.mock_get.return_value.ok = True
+        self.mock_get.return_value.content = json.dumps({"rates": {"CLP": 900.0}}).encode()
+        self.assertEqual(exchange.get_tasa_cambio("CLP"), 900.0)
+        self.assertEqual(self.mock_get.call_count, exchange._BREAKER_MAX_FALLAS + 2)
+
+    def test_fechas_de_hoy_o_futuras_usan_latest(self):
+        """
+        Hoy y fechas futuras no tienen tasa histórica: se consultan en /latest; el resto en /historical.
+        """
+        self.mock_get.return_value.content = json.dumps({"rates": {"CLP": 900.0}}).encode()
+        for fecha, endpoint in ((self.today + timedelta(days=3), "/latest.json"),
+                                (self.today, "/latest.json"),
+                                (self.today - timedelta(days=1), f"/historical/{self.today - timedelta(days=1)}.json")):
+            exchange.get_tasa_cambio("CLP", fecha=fecha)
+            self.assertTrue(self.mock_get.call_args.args[0].endswith(endpoint), fecha)
+
+
+class TestValidacionLote(_OxrMockMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.empleado_ventas = Empleado(id="e_sales", nombre="John", apellido="Doe", cost_center="sales_team")
+
+    def test_lote_una_llamada_por_fecha(self):
+        """
+        Lote con CLP y MXN en la misma fecha + USD -> 1 request a OXR; resultados en el mismo orden.
+        """
+        self.mock_get.return_value.content = json.dumps({"rates": {"CLP": 1000.0, "MXN": 20.0}}).encode()
+        fecha = self.today - timedelta(days=3)
+        gastos = [
+            Gasto(id="g_clp", monto=90000, moneda="CLP", fecha=fecha, categoria="food", empleado=self.empleado_ventas),
+            Gasto(id="g_usd", monto=50, moneda="USD", fecha=fecha, categoria="food", empleado=self.empleado_ventas),
+            Gasto(id="g_mxn", monto=2400, moneda="MXN", fecha=fecha, categoria="food", empleado=self.empleado_ventas),
+        ]
+        resultados = validator.validar_gastos(gastos)
+        self.assertEqual([r["gasto_id"] for r in resultados], ["g_clp", "g_usd", "g_mxn"])
+        # 90.000 CLP = 90 USD -> APROBADO; 2.400 MXN = 120 USD -> PENDIENTE
+        self.assertEqual([r["status"] for r in resultados], ["APROBADO", "APROBADO", "PENDIENTE"])
+        self.assertEqual(self.mock_get.call_count, 1)
+
+    def test_lote_varias_fechas(self):
+        """
+        Lote con CLP en dos fechas distintas -> 1 request a OXR por fecha (en paralelo).
+        """
+        def respuesta(url, params, timeout):
+            r = mock.Mock()
+            tasa = 1000.0 if str(fecha_1) in url else 500.0
+            r.content = json.dumps({"rates": {"CLP": tasa}}).encode()
+            return r
+        self.mock_get.side_effect = respuesta
+        fecha_1 = self.today - timedelta(days=3)
+        fecha_2 = self.today - timedelta(days=4)
+        gastos = [
+            Gasto(id="g_1", monto=90000, moneda="CLP", fecha=fecha_1, categoria="food", empleado=self.empleado_ventas),
+            Gasto(id="g_2", monto=90000, moneda="CLP", fecha=fecha_2, categoria="food", empleado=self.empleado_ventas),
+        ]
+        resultados = validator.validar_gastos(gastos)
+        # 90.000 CLP = 90 USD (fecha_1) -> APROBADO; = 180 USD (fecha_2) -> RECHAZADO
+        self.assertEqual([r["status"] for r in resultados], ["APROBADO", "RECHAZADO"])
+        self.assertEqual(self.mock_get.call_count, 2)
+
+    def test_rechazado_no_consulta_tasa(self):
+        """
+        Gasto en CLP ya rechazado por centro de costo -> no se consulta la tasa de cambio.
+        """
+        empleado_ingenieria = Empleado(id="e_eng", nombre="John", apellido="Smith", cost_center="core_engineering")
+        gasto = Gasto(id="g_cc", monto=90000, moneda="CLP", fecha=self.today, categoria="food", empleado=empleado_ingenieria)
+        self.assertTrue(validator.rechazo_rapido(gasto, self.today))
+        resultado = validator.validar_gasto(gasto, today=self.today)
+        self.assertEqual(resultado["status"], "RECHAZADO")
+        self.assertEqual(validator.validar_gastos([gasto])[0]["status"], "RECHAZADO")
+        self.mock_get.assert_not_called()
+
+
+class TestValidarGastoApi(TestCase):
+    def setUp(self):
+        self.payload = {
+            "gasto_id": "g_api",
+            "monto": 50,
+            "moneda": "USD",
+            "fecha": datetime.now().date().isoformat(),
+            "categoria": "food",
+            "empleado_id": "e_sales",
+            "empleado_cost_center": "sales_team",
+        }
+
+    def _post(self, payload):
+        return self.client.post("/api/validate", data=json.dumps(payload), content_type="application/json")
+
+    def test_gasto_valido(self):
+        response = self._post(self.payload)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "APROBADO")
+
+    def test_fecha_no_iso_rechazada(self):
+        """
+        Solo se acepta YYYY-MM-DD (no otras variantes ISO como "20240101").
+        """
+        for fecha in ("20240101", "01/02/2024", "2024-13-01"):
+            response = self._post({**self.payload, "fecha": fecha})
+            self.assertEqual(response.status_code, 400, fecha)
+
+    def test_moneda_se_normaliza(self):
+        """
+        "usd" se trata como la moneda base (sin consultar tasas de cambio).
+        """
+        response = self._post({**self.payload, "moneda": "usd"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "APROBADO")
+
+    def test_respuesta_sin_orjson_serializable(self):
+        """
+        Si orjson no puede serializar la respuesta (gasto_id entero de más de 64 bits) se usa JsonResponse.
+        """
+        with mock.patch.object(views, "orjson") as orjson_falso:
+            orjson_falso.dumps.side_effect = TypeError("Integer exceeds 64-bit range")
+            response = self._post({**self.payload, "gasto_id": 2**70})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["gasto_id"], 2**70)
+
+
+class TestAnalyze(TestCase):
+    """
+    analyze.py: lectura del CSV y caches en disco (resultados de la corrida anterior y tasas históricas).
+    """
+    def setUp(self):
+        self.hoy = datetime.now().date()
+        self.ayer = self.hoy - timedelta(days=1)
+        self.empleado = Empleado(id="e_sales", nombre="John", apellido="Doe", cost_center="sales_team")
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+
+    def _gasto(self, **campos):
+        datos = dict(id="g_1", monto=50.0, moneda="USD", fecha=self.ayer, categoria="food", empleado=self.empleado)
+        datos.update(campos)
+        return Gasto(**datos)
+
+    def test_parse_date(self):
+        """
+        Mismo comportamiento que strptime("%Y-%m-%d"): mes y día de 1 o 2 dígitos, año de 4.
+        """
+        for texto, esperado in (("2026-01-05", date(2026, 1, 5)), ("2026-1-5", date(2026, 1, 5)),
+                                ("2026-01-5", date(2026, 1, 5)), (" 2024-12-31 ", date(2024, 12, 31))):
+            self.assertEqual(analyze._parse_date(texto), esperado, texto)
+        for texto in ("", "2026-02-30", "2026-001-05", "026-01-05", "+2026-1-5", "2026-1_-5",
+                      "2026/01/05", "20260105", "2026-01-05-01", "2026-+1-05"):
+            self.assertIsNone(analyze._parse_date(texto), texto)
+
+    def test_iter_gastos_lineas_vacias_columnas_faltantes_y_filas_cortas(self):
+        """
+        Líneas en blanco se omiten sin aviso; una columna ausente o una fila corta dan campos vacíos.
+        """
+        path = self.dir / "gastos.csv"
+        path.write_text(
+            "gasto_id,empleado_id,categoria,moneda,fecha,monto,empleado_nombre,empleado_cost_center\n"
+            "g1,e1,food,USD,2024-01-01,10,Ana,sales\n"
+            "\n"
+            "g2,e1,food,USD,2024-01-02,20\n"
+            "g3,e2,food,USD,2024-01-03\n"
+            "\n"
+            "\n",
+            encoding="utf-8",
+        )
+        with mock.patch("sys.stdout", new_callable=io.StringIO) as salida:
+            gastos = list(analyze.iter_gastos(path))
+        # Solo g3 (sin monto) genera aviso; las líneas en blanco no
+        self.assertEqual(salida.getvalue().count("[WARN]"), 1)
+        self.assertIn("'g3'", salida.getvalue())
+        self.assertEqual([g.id for g in gastos], ["g1", "g2"])
+        # Columna ausente (empleado_apellido) -> ""
+        self.assertEqual((gastos[0].empleado.apellido, gastos[0].empleado.cost_center), ("", "sales"))
+        # Fila corta -> las columnas que faltan al final quedan vacías
+        self.assertEqual((gastos[1].monto, gastos[1].empleado.nombre, gastos[1].empleado.cost_center), (20.0, "", ""))
+
+        with mock.patch("sys.stdout", new_callable=io.StringIO) as salida:
+            self.assertEqual(len(list(analyze.iter_gastos(path, avisar=False))), 2)
+        self.assertEqual(salida.getvalue(), "")
+
+    def test_retry_after_acotado(self):
+        """
+        Un Retry-After largo de OXR no frena el batch: la espera se acota (también en los reintentos).
+        """
+        respuesta = mock.Mock(headers={"Retry-After": "3600"})
+        self.assertEqual(analyze._RETRY.get_retry_after(respuesta), analyze.OXR_MAX_RETRY_AFTER)
+        siguiente = analyze._RETRY.increment(method="GET", url="/api/latest.json", response=mock.Mock(status=429))
+        self.assertEqual(siguiente.get_retry_after(respuesta), analyze.OXR_MAX_RETRY_AFTER)
+
+    def test_huella_cambia_con_campos_relevantes(self):
+        gasto = self._gasto()
+        self.assertEqual(analyze.huella_gasto(gasto), analyze.huella_gasto(self._gasto()))
+        for campos in ({"monto": 50.01}, {"moneda": "CLP"}, {"fecha": self.hoy}, {"categoria": "transport"},
+                       {"empleado": Empleado(id="e_eng", nombre="J", apellido="S", cost_center="core_engineering")}):
+            self.assertNotEqual(analyze.huella_gasto(gasto), analyze.huella_gasto(self._gasto(**campos)), campos)
+
+    def test_cache_resultados_invalido_si_cambia_la_firma(self):
+        """
+        El cache solo sirve para el mismo día, la misma política y la misma versión de formato.
+        """
+        path = self.dir / "sub" / "resultados.json.gz"
+        filas = {"g_1": ["abc", {"gasto_id": "g_1", "status": "APROBADO", "alertas": []}]}
+        analyze.guardar_cache_resultados(path, self.hoy, filas)
+        self.assertEqual(analyze.cargar_cache_resultados(path, self.hoy), filas)
+        self.assertEqual(analyze.cargar_cache_resultados(path, self.ayer), {})
+        with mock.patch.dict(analyze.POLITICA, {"moneda_base": "EUR"}):
+            self.assertEqual(analyze.cargar_cache_resultados(path, self.hoy), {})
+        with mock.patch.object(analyze, "RESULTS_CACHE_VERSION", analyze.RESULTS_CACHE_VERSION + 1):
+            self.assertEqual(analyze.cargar_cache_resultados(path, self.hoy), {})
+        self.assertEqual(analyze.cargar_cache_resultados(self.dir / "no_existe.json.gz", self.hoy), {})
+        path.write_bytes(b"no es gzip")
+        with mock.patch("sys.stdout", new_callable=io.StringIO):
+            self.assertEqual(analyze.cargar_cache_resultados(path, self.hoy), {})
+
+    def test_resultado_reutilizado_sin_revalidar(self):
+        """
+        Una fila sin cambios se toma del cache; las alertas que se agreguen luego no lo modifican.
+        """
+        gasto = self._gasto(monto=120.0)
+        nuevos = {}
+        resultado = analyze.validar_con_cache(gasto, {}, nuevos, {}, self.hoy)
+        self.assertEqual(resultado["status"], "PENDIENTE")
+        self.assertIn("g_1", nuevos)
+
+        siguientes = {}
+        with mock.patch.object(analyze, "evaluar_gasto") as evaluar:
+            reutilizado = analyze.validar_con_cache(gasto, nuevos, siguientes, {}, self.hoy)
+        evaluar.assert_not_called()
+        self.assertEqual(reutilizado, resultado)
+        reutilizado["alertas"].append({"codigo": "DUPLICADO_EXACTO", "mensaje": "..."})
+        self.assertEqual(len(siguientes["g_1"][1]["alertas"]), 1)
+
+        # Si la fila cambió, se vuelve a validar
+        with mock.patch.object(analyze, "evaluar_gasto", wraps=analyze.evaluar_gasto) as evaluar:
+            analyze.validar_con_cache(self._gasto(monto=20.0), nuevos, {}, {}, self.hoy)
+        evaluar.assert_called_once()
+
+    def test_resultados_que_no_se_cachean(self):
+        """
+        No se guardan: filas sin tasa (fallback) ni filas no-USD de hoy (la tasa de hoy aún cambia).
+        """
+        nuevos = {}
+        sin_tasa = self._gasto(id="g_sin_tasa", moneda="CLP", monto=9000.0)
+        resultado = analyze.validar_con_cache(sin_tasa, {}, nuevos, {}, self.hoy)
+        self.assertEqual(resultado["alertas"][0]["codigo"], "TASA_CAMBIO_NO_DISPONIBLE")
+
+        tasas = {self.hoy.toordinal(): {"CLP": 900.0}, self.ayer.toordinal(): {"CLP": 900.0}}
+        de_hoy = self._gasto(id="g_hoy", moneda="CLP", monto=9000.0, fecha=self.hoy)
+        self.assertEqual(analyze.validar_con_cache(de_hoy, {}, nuevos, tasas, self.hoy)["status"], "APROBADO")
+        self.assertEqual(nuevos, {})
+
+        de_ayer = self._gasto(id="g_ayer", moneda="CLP", monto=9000.0)
+        analyze.validar_con_cache(de_ayer, {}, nuevos, tasas, self.hoy)
+        self.assertEqual(list(nuevos), ["g_ayer"])
+
+    def test_cache_tasas_combina_al_escribir(self):
+        """
+        Las tasas nuevas de una fecha se agregan a las ya guardadas; con todas en cache no se consulta OXR.
+        """
+        cache = analyze.abrir_cache_tasas(self.dir / "sub" / "tasas.sqlite")
+        self.addCleanup(cache.close)
+        d = self.ayer.toordinal()
+        cache.execute("INSERT INTO rates VALUES (?, ?)", (self.ayer.isoformat(), json.dumps({"CLP": 900.0, "EUR": 0.9})))
+
+        with mock.patch.object(analyze, "_http_get_json", return_value={"rates": {"MXN": 18.0}}) as http:
+            tasas, n = analyze.fetch_tipos_cambio_agrupados_fecha("app", {d: {"CLP", "MXN"}}, cache)
+        self.assertEqual((n, http.call_count), (1, 1))
+        # La tasa ya guardada (CLP) se usa junto con la recién obtenida
+        self.assertEqual(tasas[d], {"CLP": 900.0, "MXN": 18.0})
+        self.assertEqual(analyze._leer_cache_tasas(cache, self.ayer.isoformat()), {"CLP": 900.0, "EUR": 0.9, "MXN": 18.0})
+
+        with mock.patch.object(analyze, "_http_get_json") as http:
+            tasas, n = analyze.fetch_tipos_cambio_agrupados_fecha("app", {d: {"CLP", "MXN"}}, cache)
+        http.assert_not_called()
+        self.assertEqual((n, tasas[d]), (0, {"CLP": 900.0, "MXN": 18.0}))
+
+    def test_cache_tasas_parcial_sirve_si_falla_la_consulta(self):
+        """
+        Si la consulta de una fecha falla, las monedas que ya estaban en cache para esa fecha se usan igual.
+        """
+        cache = analyze.abrir_cache_tasas(self.dir / "tasas.sqlite")
+        self.addCleanup(cache.close)
+        d = self.ayer.toordinal()
+        cache.execute("INSERT INTO rates VALUES (?, ?)", (self.ayer.isoformat(), json.dumps({"CLP": 900.0})))
+        with mock.patch.object(analyze, "_http_get_json", side_effect=OSError("sin red")), \
+                mock.patch("sys.stdout", new_callable=io.StringIO):
+            tasas, n = analyze.fetch_tipos_cambio_agrupados_fecha("app", {d: {"CLP", "MXN"}}, cache)
+        self.assertEqual((n, tasas[d]), (1, {"CLP": 900.0}))
+
+    def test_fechas_de_hoy_o_futuras_una_sola_consulta_latest(self):
+        """
+        Hoy y fechas futuras comparten un solo request a /latest; las fechas pasadas van a /historical.
+        """
+        manana = self.hoy + timedelta(days=1)
+        needed = {d.toordinal(): {"CLP"} for d in (self.ayer, self.hoy, manana)}
+        with mock.patch.object(analyze, "_http_get_json", return_value={"rates": {"CLP": 950.0}}) as http:
+            tasas, n = analyze.fetch_tipos_cambio_agrupados_fecha("app", needed)
+        urls = sorted(c.args[0].split(".json")[0] for c in http.call_args_list)
+        self.assertEqual(urls, [analyze.OXR_BASE_URL + "/historical/" + self.ayer.isoformat(),
+                                analyze.OXR_BASE_URL + "/latest"])
+        self.assertEqual(n, 2)
+        self.assertEqual(tasas, {d: {"CLP": 950.0} for d in needed})
 
+    def test_cache_tasas_no_guarda_hoy_ni_lee_datos_corruptos(self):
+        cache = analyze.abrir_cache_tasas(self.dir / "tasas.sqlite")
+        self.addCleanup(cache.close)
+        with mock.patch.object(analyze, "_http_get_json", return_value={"rates": {"CLP": 950.0}}):
+            analyze.fetch_tipos_cambio_agrupados_fecha("app", {self.hoy.toordinal(): {"CLP"}}, cache)
+        self.assertEqual(analyze._leer_cache_tasas(cache, self.hoy.isoformat()), {})
+        cache.execute("INSERT INTO rates VALUES (?, ?)", (self.ayer.isoformat(), "{no es json"))
+        self.assertEqual(analyze._leer_cache_tasas(cache, self.ayer.isoformat()), {})
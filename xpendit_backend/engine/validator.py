@@ -1,105 +1,123 @@
-from datetime import datetime
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from typing import Iterable
 from engine.models import Gasto
 from engine import policy
-from engine.exchange import get_tasa_cambio
+from engine.exchange import get_tasa_cambio, get_tasas_cambio
 
-def validar_gasto(gasto: Gasto) -> dict:
+# Estados intermedios como bits: el estado final es el de mayor severidad presente
+APROBADO = 1
+PENDIENTE = 2
+RECHAZADO = 4
+
+# Consultas a OXR en paralelo (una por fecha) al precargar las tasas de un lote
+MAX_CONSULTAS_TASAS = 8
+
+def rechazo_rapido(gasto: Gasto, today: date | None = None) -> bool:
+    """
+    Indica si el gasto queda RECHAZADO solo con las reglas baratas (centro de costo y antigüedad),
+    sin consultar tasas de cambio. Útil en lotes cuando basta saber si el gasto pasa o no.
+    """
+    if (gasto.empleado.cost_center, gasto.categoria) in policy.PROHIBIDOS:
+        return True
+    if today is None:
+        today = datetime.now().date()
+    return (today - gasto.fecha).days > policy.MAX_RECHAZADO
+
+
+def validar_gasto(gasto: Gasto, today: date | None = None) -> dict:
     """
     Valida un gasto individual según las reglas de la política (engine.policy).
+    'today' es la fecha de referencia para la antigüedad; si no se entrega, se usa la fecha actual
+    (en lotes conviene calcularla una sola vez y pasarla).
+    Las reglas se evalúan de la más barata a la más cara: la de categoría puede requerir una tasa
+    de cambio (I/O), así que solo se consulta si la categoría tiene límites y el gasto aún no está
+    RECHAZADO (en ese caso el estado final ya no puede cambiar). Las alertas se emiten siempre en el
+    mismo orden: antigüedad, categoría, centro de costo.
     Devuelve un dict. de resultados con estado y alertas.
     """
     alertas = [] # recopila cualquier alerta de violación de reglas
-    estados = [] # recopila estados intermedios sugeridos por las reglas
+    estados = 0 # máscara de bits con los estados intermedios sugeridos por las reglas
+
+    ################################################################
+    ##### 1. Regla - Categoría prohibida para centro de costos #####
+    ################################################################
+    # Se evalúa primero (sin I/O), pero su alerta se agrega al final para mantener el orden de las alertas
+    alerta_prohibido = policy.ALERTAS_CENTRO_COSTO.get((gasto.empleado.cost_center, gasto.categoria))
+    if alerta_prohibido is not None:
+        estados |= RECHAZADO
 
     ##########################################
-    ##### 1. Regla – Antigüedad del gasto ####
+    ##### 2. Regla – Antigüedad del gasto ####
     ##########################################
-    today = datetime.now().date()
+    if today is None:
+        today = datetime.now().date()
     diferencia_dias = (today - gasto.fecha).days
     # Comprobar plazos dispuestos en la política
-    max_dias_pendientes = policy.POLITICA["limite_antiguedad"]["pendiente_dias"]
-    max_dias_rechazados = policy.POLITICA["limite_antiguedad"]["rechazado_dias"]
-    if diferencia_dias > max_dias_rechazados:
-        estados.append("RECHAZADO")
-        alertas.append({
-            "codigo": "LIMITE_ANTIGUEDAD",
-            "mensaje": f"Gasto excede los {max_dias_rechazados} días. No es reembolsable."
-        })
-    elif diferencia_dias > max_dias_pendientes:
-        estados.append("PENDIENTE")
-        alertas.append({
-            "codigo": "LIMITE_ANTIGUEDAD",
-            "mensaje": f"Gasto excede los {max_dias_pendientes} días. Requiere revisión."
-        })
+    if diferencia_dias > policy.MAX_RECHAZADO:
+        estados |= RECHAZADO
+        alertas.append(policy.ALERTA_ANTIGUEDAD_RECHAZO)
+    elif diferencia_dias > policy.MAX_PENDIENTE:
+        estados |= PENDIENTE
+        alertas.append(policy.ALERTA_ANTIGUEDAD_PENDIENTE)
     else:
-        estados.append("APROBADO")
+        estados |= APROBADO
         # No se emiten alertas si la antiguedad es de hasta 30 días (gasto compliant)
 
     #####################################################
-    ##### 2. Regla - Límites de gasto por categoría #####
+    ##### 3. Regla - Límites de gasto por categoría #####
     #####################################################
+    limites = policy.CAT_LIMITS.get(gasto.categoria)
     moneda_base = policy.POLITICA["moneda_base"] # "USD"
-    mnt_en_usd = gasto.monto
-    if gasto.moneda != moneda_base:
-        tasa = get_tasa_cambio(gasto.moneda, fecha=gasto.fecha)
-        if tasa is None:
-            # Si no pudimos consultar la tasa, marcar para revisión manual
-            estados.append("PENDIENTE")
-            alertas.append({
-                "codigo": "ERROR_TASA_CAMBIO",
-                "mensaje": f"No se pudo obtener tasa de cambio para {gasto.moneda}"
-            })
-        else:
-            mnt_en_usd = gasto.monto / tasa
-    # Aplicación de límites por categoría a través de mnt_en_usd
-    limites_cat = policy.POLITICA["limites_por_categoria"]
-    if gasto.categoria in limites_cat:
-        limites = limites_cat[gasto.categoria]
-        aprobado_hasta = limites["aprobado_hasta"]
-        pendiente_hasta = limites["pendiente_hasta"]
-        if mnt_en_usd > pendiente_hasta:
-            # supera el límite "PENDIENTE" -> rechazar
-            estados.append("RECHAZADO")
-            alertas.append({
-                "codigo": "LIMITE_CATEGORIA",
-                "mensaje": f"El gasto de '{gasto.categoria}' excede el límite permitido."
-            })
-        elif mnt_en_usd > aprobado_hasta:
-            # está dentro del rango "PENDIENTE"
-            estados.append("PENDIENTE")
-            alertas.append({
-                "codigo": "LIMITE_CATEGORIA",
-                "mensaje": f"El gasto de '{gasto.categoria}' excede el límite aprobado; requiere revisión."
-            })
-        else:
-            # está dentro del rango de aprobación
-            estados.append("APROBADO")
-            # no se emite ninguna alerta al estar aprobado
-    else:
+    if limites is None:
         # La categoría del gasto no está en la política,
-        # No se aplicará ninguna regla específica
+        # No se aplicará ninguna regla específica (ni hace falta convertir el monto)
+        pass
+    elif gasto.moneda != moneda_base and estados & RECHAZADO:
+        # Ya rechazado: convertir el monto no cambia el estado final, se evita la consulta de la tasa
         pass
+    else:
+        mnt_en_usd = gasto.monto
+        if gasto.moneda != moneda_base:
+            tasa = get_tasa_cambio(gasto.moneda, fecha=gasto.fecha)
+            if tasa is None:
+                # Si no pudimos consultar la tasa, marcar para revisión manual
+                estados |= PENDIENTE
+                alertas.append({
+                    "codigo": "ERROR_TASA_CAMBIO",
+                    "mensaje": f"No se pudo obtener tasa de cambio para {gasto.moneda}"
+                })
+                # Sin tasa no hay monto en USD: el límite de la categoría no se evalúa (comparar el monto
+                # en la moneda original contra un límite en USD daría un resultado sin sentido)
+                mnt_en_usd = None
+            else:
+                mnt_en_usd = gasto.monto / tasa
+        # Aplicación de límites por categoría a través de mnt_en_usd
+        if mnt_en_usd is not None:
+            aprobado_hasta, pendiente_hasta = limites
+            if mnt_en_usd > pendiente_hasta:
+                # supera el límite "PENDIENTE" -> rechazar
+                estados |= RECHAZADO
+                alertas.append(policy.ALERTAS_CATEGORIA_RECHAZO[gasto.categoria])
+            elif mnt_en_usd > aprobado_hasta:
+                # está dentro del rango "PENDIENTE"
+                estados |= PENDIENTE
+                alertas.append(policy.ALERTAS_CATEGORIA_PENDIENTE[gasto.categoria])
+            else:
+                # está dentro del rango de aprobación
+                estados |= APROBADO
+                # no se emite ninguna alerta al estar aprobado
 
-    ################################################################
-    ##### 3. Regla - Categoría prohibida para centro de costos #####
-    ################################################################
-    for regla in policy.POLITICA.get("reglas_centro_costo", []):
-        if (
-            gasto.empleado.cost_center == regla["cost_center"]
-            and gasto.categoria == regla["categoria_prohibida"]
-        ):
-            estados.append("RECHAZADO")
-            alertas.append({
-                "codigo": "POLITICA_CENTRO_COSTO",
-                "mensaje": f"El C.C. '{regla['cost_center']}' no puede reportar a '{gasto.categoria}'."
-            })
+    if alerta_prohibido is not None:
+        alertas.append(alerta_prohibido)
 
     # Determinar estado final por prioridad
-    if "RECHAZADO" in estados:
+    if estados & RECHAZADO:
         estado_final = "RECHAZADO"
-    elif "PENDIENTE" in estados:
+    elif estados & PENDIENTE:
         estado_final = "PENDIENTE"
-    elif "APROBADO" in estados:
+    elif estados & APROBADO:
         estado_final = "APROBADO"
     else:
         estado_final = "PENDIENTE"
@@ -109,3 +127,30 @@ def validar_gasto(gasto: Gasto) -> dict:
         "status": estado_final,
         "alertas": alertas,
     }
+
+
+def validar_gastos(gastos: Iterable[Gasto], today: date | None = None) -> list[dict]:
+    """
+    Valida un lote de gastos según las reglas de la política (engine.policy).
+    Antes de validar, precarga en cache las tasas de todas las monedas del lote con
+    una sola llamada a OXR por fecha (las fechas se consultan en paralelo), así la validación
+    de cada gasto no sale a la red.
+    La fecha de referencia ('today') se calcula una sola vez para todo el lote.
+    Devuelve la lista de resultados en el mismo orden de entrada.
+    """
+    if today is None:
+        today = datetime.now().date()
+    gastos = list(gastos)
+    moneda_base = policy.POLITICA["moneda_base"]
+    monedas_por_fecha = defaultdict(set)
+    for gasto in gastos:
+        # Solo se precargan tasas que validar_gasto va a consultar
+        if (gasto.moneda != moneda_base and gasto.categoria in policy.CAT_LIMITS
+                and not rechazo_rapido(gasto, today)):
+            monedas_por_fecha[gasto.fecha].add(gasto.moneda)
+    if monedas_por_fecha:
+        # El tiempo total queda cerca del de la consulta más lenta, no de la suma de todas
+        workers = min(MAX_CONSULTAS_TASAS, len(monedas_por_fecha))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(get_tasas_cambio, monedas_por_fecha.values(), monedas_por_fecha.keys()))
+    return [validar_gasto(gasto, today=today) for gasto in gastos]
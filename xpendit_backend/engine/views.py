@@ -1,40 +1,63 @@
 from django.shortcuts import render
 import json
-from django.http import JsonResponse
+import sys
+from django.http import HttpResponse, JsonResponse
 from engine.models import Empleado, Gasto
 from engine.validator import validar_gasto
 from django.views.decorators.csrf import csrf_exempt
-from datetime import datetime
+from datetime import date
+
+try:
+    # Opcional: serializador JSON en C que produce bytes directamente; si no, JsonResponse (json de la stdlib)
+    import orjson  # type: ignore
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+def _json_response(payload: dict, status: int = 200) -> HttpResponse:
+    if orjson is not None:
+        try:
+            return HttpResponse(orjson.dumps(payload), status=status, content_type="application/json")
+        except TypeError:
+            # orjson es más estricto que json (p. ej. enteros de más de 64 bits en 'gasto_id'):
+            # JSONEncodeError hereda de TypeError, y en ese caso se usa el encoder de la stdlib
+            pass
+    return JsonResponse(payload, status=status)
 
 @csrf_exempt
 def validar_gasto_api(request):
     if request.method != "POST":
-        return JsonResponse({"error": "Solo método POST permitido"}, status=405)
+        return _json_response({"error": "Solo método POST permitido"}, status=405)
     try:
-        data = json.loads(request.body.decode('utf-8'))
+        data = json.loads(request.body)  # json.loads acepta bytes (UTF-8) directamente
     except ValueError:
-        return JsonResponse({"error": "JSON inválido"}, status=400)
+        return _json_response({"error": "JSON inválido"}, status=400)
     # Extraer campos de datos del gasto desde JSON
     try:
         gasto_id = data["gasto_id"]
         monto = float(data["monto"])
-        moneda = data["moneda"]
+        # Monedas y categorías son pocos valores repetidos: se internan para que las búsquedas
+        # en las tablas de la política y del cache de tasas comparen por identidad
+        moneda = sys.intern(str(data["moneda"]).strip().upper())
         fecha_str = data["fecha"] # Formato esperado: "YYYY-MM-DD"
-        categoria = data["categoria"]
+        categoria = sys.intern(str(data["categoria"]))
         empleado_id = data["empleado_id"]
         nombre = data.get("empleado_nombre", "")
         apellido = data.get("empleado_apellido", "")
         cost_center = data.get("empleado_cost_center")
     except KeyError as e:
-        return JsonResponse({"error": f"Falta campo requerido: {e}"}, status=400)
+        return _json_response({"error": f"Falta campo requerido: {e}"}, status=400)
     # Construir objetos Empleado y Gasto
     try:
-        fecha = datetime.strptime(fecha_str, "%Y-%m-%d").date()
-    except Exception:
-        return JsonResponse({"error": "Formato de fecha inválido, se espera YYYY-MM-DD"}, status=400)
+        fecha = date.fromisoformat(fecha_str)
+        # fromisoformat también acepta otras variantes ISO (p. ej. "20240101"): solo se admite YYYY-MM-DD
+        if fecha.isoformat() != fecha_str:
+            raise ValueError(fecha_str)
+    except (TypeError, ValueError):
+        return _json_response({"error": "Formato de fecha inválido, se espera YYYY-MM-DD"}, status=400)
     emp = Empleado(id=empleado_id, nombre=nombre, apellido=apellido, cost_center=cost_center)
     gs = Gasto(id=gasto_id, monto=monto, moneda=moneda, fecha=fecha, categoria=categoria, empleado=emp)
     # Validar gasto usando la función del validador
-    resultado = validar_gasto(gs)
-    return JsonResponse(resultado)
+    resultado = validar_gasto(gs, today=date.today())
+    return _json_response(resultado)
 
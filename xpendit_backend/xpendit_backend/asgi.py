@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "xpendit_backend.settings")
 
 application = get_asgi_application()
+
+# Precarga opcional del cache de tasas de cambio, solo en procesos que sirven requests
+from engine.apps import precargar_tasas  # noqa: E402
+
+precargar_tasas()
@@ -129,3 +129,6 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 # OpenExchangeRates App ID access
 OXR_APP_ID = os.getenv("OXR_APP_ID")
+
+# Monedas cuyas tasas se precargan al iniciar (ej: "CLP,MXN,EUR"); vacío = sin precarga
+OXR_MONEDAS_PRECARGA = [m.strip() for m in os.getenv("OXR_MONEDAS_PRECARGA", "").split(",") if m.strip()]
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "xpendit_backend.settings")
 
 application = get_wsgi_application()
+
+# Precarga opcional del cache de tasas de cambio, solo en procesos que sirven requests
+from engine.apps import precargar_tasas  # noqa: E402
+
+precargar_tasas()